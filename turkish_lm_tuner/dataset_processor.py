@@ -1,6 +1,18 @@
 from transformers import AutoTokenizer
+from datasets import Features, Sequence, Value
+from tokenizers.processors import TemplateProcessing
 import numpy as np
+import pyarrow.compute as pc
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import os
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -9,7 +21,270 @@ formatter = logging.Formatter('%(levelname)s - %(asctime)s - %(name)s: %(message
 stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
-from .tr_datasets import initialize_dataset
+from .tr_datasets import initialize_dataset, NUM_PROC
+
+RAW_ID_COLUMNS = ['input_ids_raw', 'target_ids_raw']
+# Input lengths are stored for trainers with group_by_length, so that batches of similar lengths need little padding
+LENGTH_COLUMN = 'length'
+# Text columns are dropped after tokenization so that batches can be padded by the data collators
+TEXT_COLUMNS = ['input_text', 'target_text']
+# Fast tokenizers amortize the per-call overhead over large batches
+TOKENIZATION_BATCH_SIZE = 10000
+CACHE_DIR = os.path.expanduser("~/.cache/tlm-tuner")
+# Part of every cache fingerprint, to be increased whenever the columns or the features written by the maps change
+CACHE_VERSION = 2
+# Only the ids are kept from raw tokenization, attention masks are built when the ids are truncated and padded
+RAW_TOKENIZER_KWARGS = {"add_special_tokens": False, "return_attention_mask": False, "return_token_type_ids": False,
+                        "return_offsets_mapping": False, "return_length": False}
+
+@functools.lru_cache(maxsize=1)
+def _get_tokenizer(tokenizer_name):
+    """
+    Loads the tokenizer once per process, so that map workers receive only its name and reuse it across batches
+    Args:
+        tokenizer_name: Name of the tokenizer to be loaded
+    """
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    add_eos_post_processor(tokenizer)
+    return tokenizer
+
+def add_eos_post_processor(tokenizer):
+    """
+    Sets a post processor appending the EOS token to every sequence, if the tokenizer has an
+    EOS token that its template does not add. The EOS token is then added with the other special tokens
+    Args:
+        tokenizer: Fast tokenizer to be updated
+    """
+    if tokenizer.eos_token is None or not tokenizer.is_fast:
+        return
+    prefix_ids, suffix_ids = get_special_token_ids(tokenizer)
+    if suffix_ids[-1:] == [tokenizer.eos_token_id]:
+        return
+    prefix_tokens = tokenizer.convert_ids_to_tokens(prefix_ids)
+    suffix_tokens = tokenizer.convert_ids_to_tokens(suffix_ids) + [tokenizer.eos_token]
+    special_tokens = dict(zip(prefix_tokens + suffix_tokens, prefix_ids + suffix_ids + [tokenizer.eos_token_id]))
+    tokenizer._tokenizer.post_processor = TemplateProcessing(
+        single=' '.join(prefix_tokens + ['$A'] + suffix_tokens),
+        special_tokens=list(special_tokens.items()),
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_thread_pool(pid):
+    """
+    Returns a thread pool for tokenizer calls that run next to the main thread. The pool is keyed on the
+    process id, since its threads do not survive forking into map workers
+    Args:
+        pid: Id of the current process
+    """
+    return ThreadPoolExecutor(max_workers=1)
+
+def tokenize_raw_ids(examples, tokenizer_name, input_prefix=''):
+    """
+    Tokenizes the input and target texts without special tokens, truncation or padding.
+    The output does not depend on the maximum lengths or, unless an input prefix is given, the task mode,
+    so it is cached once and reused both for computing length statistics and for tokenizing with a given maximum length.
+    Args:
+        examples: Batch of examples with input_text and optionally target_text columns
+        tokenizer_name: Name of the tokenizer to be used
+        input_prefix: Text joined with the input texts before tokenization, see get_raw_input_prefix
+    """
+    tokenizer = _get_tokenizer(tokenizer_name)
+    input_texts = [input_prefix + text for text in examples["input_text"]] if input_prefix else examples["input_text"]
+    if "target_text" not in examples:
+        return {'input_ids_raw': tokenizer(input_texts, **RAW_TOKENIZER_KWARGS)['input_ids']}
+    # The Rust tokenizer releases the GIL, so the targets are tokenized on another thread while the inputs are tokenized here
+    targets = _get_thread_pool(os.getpid()).submit(tokenizer, examples["target_text"], **RAW_TOKENIZER_KWARGS)
+    inputs = tokenizer(input_texts, **RAW_TOKENIZER_KWARGS)
+    return {'input_ids_raw': inputs['input_ids'], 'target_ids_raw': targets.result()['input_ids']}
+
+def preprocess_and_tokenize(examples, preprocess_function, tokenizer_name, preprocess_kwargs, input_prefix=''):
+    """
+    Preprocesses a batch of examples and tokenizes the resulting texts with tokenize_raw_ids
+    Args:
+        examples: Batch of examples in the original dataset format
+        preprocess_function: Dataset specific preprocessing function returning input_text and optionally target_text and label columns
+        tokenizer_name: Name of the tokenizer to be used
+        preprocess_kwargs: Keyword arguments passed to the preprocessing function
+        input_prefix: Text joined with the input texts before tokenization, see get_raw_input_prefix
+    """
+    processed = preprocess_function(examples, **preprocess_kwargs)
+    output = {'label': processed['label']} if 'label' in processed else {}
+    return {**output, **tokenize_raw_ids(processed, tokenizer_name, input_prefix)}
+
+def preprocess_token_classification(examples, preprocess_function, tokenizer_name):
+    """
+    Tokenizes the words of a batch of examples and aligns their labels with the dataset specific preprocessing function.
+    Only the name of the tokenizer is passed, so that map workers don't receive a pickled tokenizer
+    Args:
+        examples: Batch of examples in the original dataset format
+        preprocess_function: Dataset specific preprocessing function taking the tokenizer
+        tokenizer_name: Name of the tokenizer to be used
+    """
+    return preprocess_function(examples, skip_output_processing=True, tokenizer=_get_tokenizer(tokenizer_name))
+
+PERCENTILES = [90, 95, 99, 99.9]
+# Lengths are histogrammed up to this value, longer sequences fall back to np.percentile
+HISTOGRAM_SIZE = 4096
+
+def _summarize(lengths, histogram_size):
+    """
+    Computes max, sum and the histogram of sequence lengths in a single pass
+    """
+    max_length = 0
+    total = 0
+    histogram = np.zeros(histogram_size + 1, dtype=np.int64)
+    for length in lengths:
+        if length > max_length:
+            max_length = length
+        total += length
+        histogram[min(length, histogram_size)] += 1
+    return max_length, total, histogram
+
+if njit is not None:
+    _summarize = njit(cache=True)(_summarize)
+
+def summarize_lengths(lengths):
+    """
+    Computes mean, max and percentile statistics of sequence lengths. Percentiles are read from the
+    cumulative histogram, which is computed in the same pass as max and mean when numba is available.
+    Both paths report the observed length at or above each percentile, i.e. np.percentile's "higher" method
+    Args:
+        lengths: NumPy array of sequence lengths
+    """
+    if njit is None:
+        stats = {"Mean": lengths.mean(), "Max": lengths.max()}
+        percentiles = np.percentile(lengths, PERCENTILES, method="higher")
+    else:
+        max_length, total, histogram = _summarize(lengths, HISTOGRAM_SIZE)
+        stats = {"Mean": total / len(lengths), "Max": max_length}
+        if max_length < HISTOGRAM_SIZE:
+            cdf = np.cumsum(histogram)
+            # Sorted position of each percentile, rounded up as np.percentile(method="higher") does
+            ranks = np.ceil(np.asarray(PERCENTILES) / 100 * (len(lengths) - 1))
+            percentiles = np.searchsorted(cdf, ranks + 1)
+        else:
+            percentiles = np.percentile(lengths, PERCENTILES, method="higher")
+    for percentile, value in zip(PERCENTILES, percentiles):
+        stats[f"{percentile}th percentile"] = value
+    return stats
+
+def get_special_token_ids(tokenizer):
+    """
+    Returns the special token ids the tokenizer adds before and after a single sequence
+    Args:
+        tokenizer: Tokenizer to be inspected
+    """
+    token_ids = tokenizer('a', add_special_tokens=False)['input_ids']
+    token_ids_with_special = tokenizer('a')['input_ids']
+    for i in range(len(token_ids_with_special) - len(token_ids) + 1):
+        if token_ids_with_special[i:i + len(token_ids)] == token_ids:
+            return token_ids_with_special[:i], token_ids_with_special[i + len(token_ids):]
+    return [], []
+
+# Texts that the task mode is tokenized with, to check whether it can be tokenized separately from the inputs
+TASK_MODE_PROBE_TEXTS = ["Merhaba dünya.", " Merhaba", "merhaba", "1923", "(a)"]
+
+def uses_task_mode(tokenizer, task_mode, task_format):
+    """
+    Returns whether the task mode is prepended to the inputs of the task format
+    """
+    return bool(task_mode) and not (task_format == 'classification' and tokenizer.eos_token is None)
+
+@functools.lru_cache(maxsize=None)
+def get_raw_input_prefix(tokenizer_name, task_mode='', task_format='conditional_generation'):
+    """
+    Returns the task mode if it has to be joined with the input texts before tokenization, an empty string otherwise.
+    The task mode is tokenized once and its ids are attached to the raw token ids of every example, unless that gives
+    different ids than tokenizing the joined texts, e.g. for pre-tokenizers that mark only the start of the string
+    Args:
+        tokenizer_name: Name of the tokenizer to be used
+        task_mode: Mode of the task, prepended to the inputs
+        task_format: Format of the task. Either 'classification' or 'conditional_generation'
+    """
+    tokenizer = _get_tokenizer(tokenizer_name)
+    if not uses_task_mode(tokenizer, task_mode, task_format):
+        return ''
+    task_mode_ids = tokenizer(task_mode, add_special_tokens=False)['input_ids']
+    for text in TASK_MODE_PROBE_TEXTS:
+        if tokenizer(task_mode + text, add_special_tokens=False)['input_ids'] != task_mode_ids + tokenizer(text, add_special_tokens=False)['input_ids']:
+            logger.info(f"Task mode {task_mode} is tokenized differently when joined with the inputs, so it is joined before tokenization")
+            return task_mode
+    return ''
+
+@functools.lru_cache(maxsize=None)
+def get_affix_ids(tokenizer_name, task_mode='', task_format='conditional_generation', target=False):
+    """
+    Returns the token ids prepended and appended to the raw token ids of inputs or targets.
+    Task mode prefix is tokenized once and attached to the token ids of every example along with the special tokens,
+    unless it is joined with the input texts before tokenization
+    Args:
+        tokenizer_name: Name of the tokenizer to be used
+        task_mode: Mode of the task, prepended to the inputs
+        task_format: Format of the task. Either 'classification' or 'conditional_generation'
+        target: Whether the affixes are for the target sequence
+    """
+    tokenizer = _get_tokenizer(tokenizer_name)
+    prefix_ids, suffix_ids = get_special_token_ids(tokenizer)
+    if target or not uses_task_mode(tokenizer, task_mode, task_format) or get_raw_input_prefix(tokenizer_name, task_mode, task_format):
+        return prefix_ids, suffix_ids
+    return prefix_ids + tokenizer(task_mode, add_special_tokens=False)['input_ids'], suffix_ids
+
+def prepare_token_ids(tokenizer, token_ids, max_length, prefix_ids, suffix_ids, return_tensors=None):
+    """
+    Truncates raw token ids and attaches the prefix and suffix ids. Sequences are padded
+    only when tensors are requested, otherwise they are padded per batch by the data collator
+    Args:
+        tokenizer: Tokenizer to be used for padding
+        token_ids: List of raw token ids
+        max_length: Maximum length of the sequences
+        prefix_ids: Token ids prepended to each sequence
+        suffix_ids: Token ids appended to each sequence
+    """
+    max_length_raw = max_length - len(prefix_ids) - len(suffix_ids)
+    input_ids = [prefix_ids + ids[:max_length_raw] + suffix_ids for ids in token_ids]
+    padding = "longest" if return_tensors is not None else False
+    return tokenizer.pad({'input_ids': input_ids}, padding=padding, return_tensors=return_tensors)
+
+def _tokenize_batch(examples, tokenizer_name, task_mode, max_input_length, max_target_length, task_format, return_tensors=None):
+    """
+    Tokenizes the input and target texts without padding. Only primitive arguments are passed,
+    so that the function is cheap to pickle for map workers
+    Args:
+        examples: Batch of examples with raw token ids or input and target texts
+        tokenizer_name: Name of the tokenizer to be used
+        task_mode: Mode of the task, prepended to the inputs
+        max_input_length: Maximum length of the input sequence
+        max_target_length: Maximum length of the target sequence
+        task_format: Format of the task. Either 'classification' or 'conditional_generation'
+    """
+    # Token classification datasets are tokenized by their own preprocessing
+    if "input_ids" in examples:
+        return examples
+
+    if "input_ids_raw" not in examples:
+        examples = {**examples, **tokenize_raw_ids(examples, tokenizer_name, get_raw_input_prefix(tokenizer_name, task_mode, task_format))}
+
+    tokenizer = _get_tokenizer(tokenizer_name)
+    inputs_tokenized = prepare_token_ids(tokenizer, examples["input_ids_raw"], max_input_length, *get_affix_ids(tokenizer_name, task_mode, task_format), return_tensors=return_tensors)
+    if task_format == 'conditional_generation' and "target_ids_raw" in examples:
+        targets_tokenized = prepare_token_ids(tokenizer, examples["target_ids_raw"], max_target_length, *get_affix_ids(tokenizer_name, task_mode, task_format, target=True), return_tensors=return_tensors)
+        return {'labels': targets_tokenized['input_ids'], **inputs_tokenized}
+    return inputs_tokenized
+
+def tokenized_features(features, task_format):
+    """
+    Returns the features of the dataset tokenized by _tokenize_batch. Token ids and attention masks are stored
+    as int32 instead of the default int64, which halves the size of the cached Arrow files
+    Args:
+        features: Features of the dataset with raw token ids
+        task_format: Format of the task. Either 'classification' or 'conditional_generation'
+    """
+    id_columns = ['input_ids', 'attention_mask']
+    if task_format == 'conditional_generation' and 'target_ids_raw' in features:
+        id_columns.append('labels')
+    tokenized = Features({name: feature for name, feature in features.items() if name not in RAW_ID_COLUMNS + TEXT_COLUMNS})
+    tokenized.update({name: Sequence(Value('int32')) for name in id_columns})
+    return tokenized
 
 class DatasetProcessor:
     """
@@ -33,7 +308,8 @@ class DatasetProcessor:
                  tokenizer_name: str = None, 
                  max_input_length: int = None, 
                  max_target_length: int = None, 
-                 dataset_loc: str = ''):
+                 dataset_loc: str = '',
+                 streaming: bool = False):
         
         logger.info(f"Initializing dataset processor for {dataset_name} dataset with {tokenizer_name} tokenizer and {task} task in {task_format} format with {task_mode} mode")
         logger.info(f"Max input length: {max_input_length} Max target length: {max_target_length}")
@@ -42,154 +318,172 @@ class DatasetProcessor:
         self.task = task
         self.task_format = task_format
         self.task_mode = task_mode
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = _get_tokenizer(tokenizer_name)
         self.max_input_length = max_input_length
         self.max_target_length = max_target_length
         self.dataset_loc = dataset_loc
+        self.streaming = streaming
+
+    def tokenization_kwargs(self):
+        """
+        Returns the keyword arguments of _tokenize_batch for the processor configuration
+        """
+        return {
+            "tokenizer_name": self.tokenizer_name,
+            "task_mode": self.task_mode,
+            "max_input_length": self.max_input_length,
+            "max_target_length": self.max_target_length,
+            "task_format": self.task_format,
+        }
+
+    def preprocess_kwargs(self):
+        """
+        Returns the keyword arguments of the dataset preprocessing function for the task format
+        """
+        if self.task == "question_generation":
+            return {"question_generation": True}
+        return {"skip_output_processing": True} if self.task_format == "classification" else {}
+
+    def raw_input_prefix(self):
+        """
+        Returns the text joined with the input texts before tokenization, see get_raw_input_prefix
+        """
+        return get_raw_input_prefix(self.tokenizer_name, self.task_mode, self.task_format)
+
+    def num_affix_tokens(self, target=False):
+        """
+        Returns the number of special and task mode tokens added to each input or target sequence
+        Args:
+            target: Whether the number of tokens added to the targets is returned
+        """
+        return sum(len(ids) for ids in get_affix_ids(self.tokenizer_name, self.task_mode, self.task_format, target=target))
+
+    def cache_fingerprint(self, *keys):
+        """
+        Returns an explicit fingerprint for a map over the dataset, so that datasets does not hash the tokenizer
+        and the preprocessing function on every call and cached results are found across runs
+        Args:
+            keys: Values that the output of the map depends on in addition to the dataset and the tokenizer
+        """
+        key = "|".join(str(k) for k in (CACHE_VERSION, self.dataset_name, self.dataset_loc, self.task, self.task_format, self.tokenizer_name, *keys))
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
 
     def load_and_preprocess_data(self, split='train'):
         """
-        Loads and preprocesses the dataset
+        Loads and preprocesses the dataset. If the processor is streaming, an IterableDataset is returned
+        that preprocesses and tokenizes the examples lazily, so that tokenization overlaps with training when
+        it is iterated over in DataLoader workers, e.g. torch.utils.data.DataLoader(dataset, num_workers=4, prefetch_factor=4)
         Args:
             split: Split of the dataset to be loaded. Either 'train', 'validation' or 'test'
         """
         logger.info(f"Loading {split} split of {self.dataset_name} dataset")
         self.dataset = initialize_dataset(self.dataset_name, self.dataset_loc)
-        data = self.dataset.load_dataset(split)
+        data = self.dataset.load_iterable_dataset(split) if self.streaming else self.dataset.load_dataset(split)
         
         logger.info(f"Preprocessing {self.dataset_name} dataset")
         preprocess_function = self.dataset.preprocess_data
 
-        column_names = data.column_names
-        column_names = [col for col in column_names if col not in ['input_text', 'target_text', 'label', 'input_ids', 'label_ids']]
+        data_columns = data.column_names
+        if data_columns is None:
+            # Features of some streamed datasets are only known after reading the first example
+            data_columns = list(next(iter(data)).keys())
+        column_names = [col for col in data_columns if col not in ['input_text', 'target_text', 'label', 'input_ids', 'label_ids']]
         
-        if self.task_format == "classification":
-            if self.task in ["ner", "pos_tagging"]: 
-                # Tokenize inputs and labels simultaneously
-                processed_dataset = data.map(preprocess_function, remove_columns=column_names, batched=True, fn_kwargs={"skip_output_processing": True, "tokenizer": self.tokenizer})
-                if "token_type_ids" in processed_dataset.column_names:
-                    processed_dataset = processed_dataset.remove_columns("token_type_ids")
+        if self.task_format == "classification" and self.task in ["ner", "pos_tagging"]:
+            # Tokenize inputs and labels simultaneously
+            map_kwargs = {}
+            if not self.streaming:
+                # Explicit versioned key, so that the map is cached even when the split is kept in memory
+                fingerprint = self.cache_fingerprint(split, data._fingerprint)
+                map_kwargs = {"new_fingerprint": fingerprint, "cache_file_name": os.path.join(CACHE_DIR, f"{fingerprint}.arrow")}
+            processed_dataset = self.dataset.apply_preprocess(data, preprocess_token_classification, remove_columns=column_names,
+                                                              fn_kwargs={"preprocess_function": preprocess_function, "tokenizer_name": self.tokenizer_name}, **map_kwargs)
+            if self.streaming or "token_type_ids" in processed_dataset.column_names:
+                processed_dataset = processed_dataset.remove_columns("token_type_ids")
+            if self.streaming:
                 return processed_dataset
-            else:
-                processed_dataset = data.map(preprocess_function, remove_columns=column_names, batched=True, fn_kwargs={"skip_output_processing": True})
-        else:
-            processed_dataset = data.map(preprocess_function, remove_columns=column_names, batched=True)
-        
+            input_lengths = pc.list_value_length(processed_dataset.with_format("arrow")['input_ids']).to_numpy()
+            return processed_dataset.add_column(LENGTH_COLUMN, input_lengths)
+        preprocess_kwargs = self.preprocess_kwargs()
+        # The fused map writes only the labels and the raw token ids, every other column of the original dataset is dropped
+        column_names = [col for col in data_columns if col not in ['input_ids', 'label_ids']]
+
         if self.max_input_length == -1 or self.max_target_length == -1:
-            # Compute token length statistics
-            self.compute_token_length(processed_dataset)
+            # Compute token length statistics without writing the preprocessed dataset to disk
+            self.stats(split, data)
             return
-        
+
+        input_prefix = self.raw_input_prefix()
+        if self.streaming:
+            processed_dataset = data.map(preprocess_and_tokenize, remove_columns=column_names, batched=True, batch_size=TOKENIZATION_BATCH_SIZE,
+                                         fn_kwargs={"preprocess_function": preprocess_function, "tokenizer_name": self.tokenizer_name, "preprocess_kwargs": preprocess_kwargs, "input_prefix": input_prefix})
+            # Columns of the mapped stream are not known in advance, removing missing columns is a no-op for iterable datasets
+            return processed_dataset.map(_tokenize_batch, batched=True, batch_size=TOKENIZATION_BATCH_SIZE, fn_kwargs=self.tokenization_kwargs(), remove_columns=RAW_ID_COLUMNS + TEXT_COLUMNS)
+
+        # Preprocess and tokenize in a single pass without truncation and padding, so that the intermediate texts
+        # are never written to disk and the raw token ids are reused across runs through the Arrow cache
+        fingerprint = self.cache_fingerprint(split, data._fingerprint, input_prefix)
+        processed_dataset = data.map(preprocess_and_tokenize, remove_columns=column_names, batched=True, batch_size=TOKENIZATION_BATCH_SIZE, num_proc=NUM_PROC, load_from_cache_file=True,
+                                     fn_kwargs={"preprocess_function": preprocess_function, "tokenizer_name": self.tokenizer_name, "preprocess_kwargs": preprocess_kwargs, "input_prefix": input_prefix},
+                                     new_fingerprint=fingerprint, cache_file_name=os.path.join(CACHE_DIR, f"{fingerprint}.arrow"))
+
         logger.info(f"Tokenizing {self.dataset_name} dataset")
-        tokenized_dataset = processed_dataset.map(self.tokenize_function, batched=True)
-        return tokenized_dataset
+        # Truncation depends on the lengths and the task mode, so the tokenized dataset gets its own key chained on the raw ids
+        fingerprint = self.cache_fingerprint(processed_dataset._fingerprint, self.task_mode, self.max_input_length, self.max_target_length)
+        features = tokenized_features(processed_dataset.features, self.task_format) if "input_ids" not in processed_dataset.column_names else None
+        tokenized_dataset = processed_dataset.map(_tokenize_batch, batched=True, batch_size=TOKENIZATION_BATCH_SIZE, num_proc=NUM_PROC, fn_kwargs=self.tokenization_kwargs(), remove_columns=[col for col in RAW_ID_COLUMNS + TEXT_COLUMNS if col in processed_dataset.column_names],
+                                                  features=features, new_fingerprint=fingerprint, cache_file_name=os.path.join(CACHE_DIR, f"{fingerprint}.arrow"))
+        input_lengths = pc.list_value_length(tokenized_dataset.with_format("arrow")['input_ids']).to_numpy()
+        return tokenized_dataset.add_column(LENGTH_COLUMN, input_lengths)
 
-    def compute_token_length(self, dataset):
+    def stats(self, split='train', data=None):
         """
-        Computes token length statistics for the dataset
+        Computes token length statistics of a split by preprocessing and tokenizing it batch by batch,
+        so that neither the preprocessed texts nor the token ids are written to disk
         Args:
-            dataset: Dataset to be processed. 
+            split: Split of the dataset. Either 'train', 'validation' or 'test'
+            data: Loaded split of the dataset, loaded with the dataset class if not given
+        Returns:
+            Input and target length statistics, target statistics are None if the dataset has no targets
         """
+        if data is None:
+            self.dataset = initialize_dataset(self.dataset_name, self.dataset_loc)
+            data = self.dataset.load_iterable_dataset(split) if self.streaming else self.dataset.load_dataset(split)
+        preprocess_kwargs = self.preprocess_kwargs()
+        length_kwargs = {**RAW_TOKENIZER_KWARGS, "return_length": True}
+        input_prefix = self.raw_input_prefix()
 
-        def get_max_length(examples):
-            return {
-                'input_len': [len(ex) for ex in self.tokenizer(examples['input_text'])['input_ids']],
-                'target_len': [len(ex) for ex in self.tokenizer(examples['target_text'])['input_ids']]
-            }
-
-        dataset = dataset.map(get_max_length, batched=True, batch_size=8)
-
-        input_lengths = [length['input_len'] for length in dataset]
-        target_lengths = [length['target_len'] for length in dataset]
-
-        stats = {
-                "Mean": np.mean,
-                "Max": max,
-                "90th percentile": lambda x: np.percentile(x, 90),
-                "95th percentile": lambda x: np.percentile(x, 95),
-                "99th percentile": lambda x: np.percentile(x, 99),
-                "99.9th percentile": lambda x: np.percentile(x, 99.9)
-            }
+        input_lengths, target_lengths = [], []
+        for batch in data.iter(batch_size=TOKENIZATION_BATCH_SIZE):
+            processed = self.dataset.preprocess_data(batch, **preprocess_kwargs)
+            input_texts = [input_prefix + text for text in processed["input_text"]] if input_prefix else processed["input_text"]
+            input_lengths.append(np.asarray(self.tokenizer(input_texts, **length_kwargs)["length"], dtype=np.int32))
+            if "target_text" in processed:
+                target_lengths.append(np.asarray(self.tokenizer(processed["target_text"], **length_kwargs)["length"], dtype=np.int32))
 
-        for stat_name, func in stats.items():
-            input_stat = func(input_lengths)
-            target_stat = func(target_lengths)
-            logger.info(f"{stat_name} input length: {input_stat}")
-            logger.info(f"{stat_name} target length: {target_stat}")
+        input_stats = summarize_lengths(np.concatenate(input_lengths) + self.num_affix_tokens())
+        target_stats = summarize_lengths(np.concatenate(target_lengths) + self.num_affix_tokens(target=True)) if target_lengths else None
+        self.log_length_statistics(input_stats, target_stats)
+        return input_stats, target_stats
 
-    def prepend_prefix(self, examples):
+    def log_length_statistics(self, input_stats, target_stats=None):
         """
-        Prepends task mode to the input text
+        Logs the token length statistics computed by summarize_lengths
         Args:
-            examples: List of input texts
+            input_stats: Statistics of the input lengths
+            target_stats: Statistics of the target lengths, if the dataset has targets
         """
-        return [f'{self.task_mode}{ex}' for ex in examples]
-    
-    def append_eos(self, examples):
-        """
-        Appends EOS token to the input text
-        Args:
-            examples: List of input texts
-        """
-        def append_eos_text(text):
-            if text.endswith(self.tokenizer.eos_token):
-                return text
-            else:
-                return f'{text}{self.tokenizer.eos_token}'
-
-        return [append_eos_text(ex) for ex in examples]
+        for stat_name in input_stats:
+            logger.info(f"{stat_name} input length: {input_stats[stat_name]}")
+            if target_stats is not None:
+                logger.info(f"{stat_name} target length: {target_stats[stat_name]}")
 
     def tokenize_function(self, examples, return_tensors=None):
         """
-        Tokenizes the input and target texts
+        Tokenizes the input and target texts without padding. The tokenized dataset should be
+        used with a data collator that pads each batch, e.g. transformers.DataCollatorForSeq2Seq(tokenizer, padding='longest')
         Args:
             examples: List of input 
         """
-        if "input_ids" in examples:
-            #examples["input_ids"] = [inputs + [self.tokenizer.pad_token_id] * (self.max_input_length - len(inputs)) if len(inputs) < self.max_input_length else inputs[:self.max_input_length] for inputs in examples["input_ids"]]
-            #examples["label_ids"] = [label + [-100] * (self.max_input_length - len(label)) if len(label) < self.max_input_length else label[:self.max_input_length] for label in examples["label_ids"]]
-            return examples
-        
-        if self.task_format == 'conditional_generation':
-            inputs_tokenized = self.tokenizer(
-                        self.prepend_prefix(examples["input_text"]),
-                        padding="max_length",
-                        truncation=True,
-                        max_length=self.max_input_length,
-                        return_token_type_ids=False,
-                        return_tensors=return_tensors,
-                   )
-            
-            if "target_text" not in examples:
-                return inputs_tokenized
-            
-            targets_tokenized = self.tokenizer(
-                        self.append_eos(examples["target_text"]),
-                        padding="max_length",
-                        truncation=True,
-                        max_length=self.max_target_length,
-                        return_token_type_ids=False,
-                        return_tensors=return_tensors,
-                   )
-            return {'labels': targets_tokenized['input_ids'], **inputs_tokenized}
-        elif self.task_format == 'classification':
-            if self.tokenizer.eos_token == None:
-                logger.info("No EOS token, don't append EOS token")
-                return self.tokenizer(
-                    examples["input_text"],
-                    padding="max_length",
-                    truncation=True,
-                    max_length=self.max_input_length,
-                    return_token_type_ids=False,
-                    return_tensors=return_tensors,
-                )
-            else:
-                logger.info("EOS token present, append EOS token")
-                return self.tokenizer(
-                    self.append_eos(self.prepend_prefix(examples["input_text"])),
-                    padding="max_length",
-                    truncation=True,
-                    max_length=self.max_input_length,
-                    return_token_type_ids=False,
-                    return_tensors=return_tensors,
-                )
+        return _tokenize_batch(examples, return_tensors=return_tensors, **self.tokenization_kwargs())
@@ -2,10 +2,12 @@ from transformers import (
     AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForSequenceClassification,
     Seq2SeqTrainer, Seq2SeqTrainingArguments,
     Trainer, TrainingArguments,
-    EvalPrediction
+    EvalPrediction,
+    DataCollatorForSeq2Seq, DataCollatorForTokenClassification, DataCollatorWithPadding
 )
 
 from .metrics import load_task_metrics
+from .dataset_processor import LENGTH_COLUMN
 import pandas as pd
 import numpy as np
 import os
@@ -18,6 +20,20 @@ formatter = logging.Formatter('%(levelname)s - %(asctime)s - %(name)s: %(message
 stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
+class DataCollatorWithoutColumns:
+    """
+    Wraps a data collator and removes the columns that are not model inputs, e.g. the length column used for group_by_length
+    Args:
+        data_collator: Data collator to be wrapped
+        columns: Columns to be removed from the features
+    """
+    def __init__(self, data_collator, columns=(LENGTH_COLUMN,)):
+        self.data_collator = data_collator
+        self.columns = columns
+
+    def __call__(self, features):
+        return self.data_collator([{k: v for k, v in feature.items() if k not in self.columns} for feature in features])
+
 class BaseEvaluator:
     def __init__(self, model_path, tokenizer_path, task, test_params, postprocess_fn=None):
         self.model_path = model_path
@@ -71,10 +87,16 @@ class EvaluatorForClassification(BaseEvaluator):
         test_args = TrainingArguments(
             **self.test_params)
 
+        if self.task in ["ner", "pos_tagging"]:
+            data_collator = DataCollatorWithoutColumns(DataCollatorForTokenClassification(tokenizer=self.tokenizer))
+        else:
+            data_collator = DataCollatorWithoutColumns(DataCollatorWithPadding(tokenizer=self.tokenizer))
+
         trainer = Trainer(
             model=model,
             args=test_args,
             compute_metrics=self.compute_metrics,
+            data_collator=data_collator,
         )
         return trainer
 
@@ -143,6 +165,7 @@ class EvaluatorForConditionalGeneration(BaseEvaluator):
             model=model,
             args=test_args,
             compute_metrics=self.compute_metrics,
+            data_collator=DataCollatorWithoutColumns(DataCollatorForSeq2Seq(self.tokenizer, model=model, padding='longest')),
         )
         return trainer
 
@@ -165,6 +188,8 @@ class EvaluatorForConditionalGeneration(BaseEvaluator):
 
         # Get post-processing function for specific dataset and task
         if inputs is not None:
+            # Inputs of different batches are padded to the same length with -100s as well
+            inputs = np.where(inputs != -100, inputs, self.tokenizer.pad_token_id)
             decoded_inputs = self.tokenizer.batch_decode(inputs, skip_special_tokens=True)
             processed_preds = self.postprocess_fn(decoded_preds, decoded_inputs)
             processed_labels = self.postprocess_fn(decoded_labels, decoded_inputs)
@@ -127,7 +127,7 @@ class LabelPredictor(BasePredictor):
     Predictor class for classification models
     """
     def __init__(self, model_name, task, task_format='classification', max_input_length=512):
-        super().__init__(model_name, task, task_format, max_input_length)
+        super().__init__(model_name, task, task_format, max_input_length=max_input_length)
 
     def predict(self, text):
         return super().predict(text)
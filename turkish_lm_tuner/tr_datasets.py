@@ -1,49 +1,104 @@
 import datasets
+import functools
+import numpy as np
+import pyarrow.compute as pc
 import sys
 import json
-import re
+import multiprocessing
+import os
 
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of processes used for loading and mapping datasets. Tokenization map workers run a second thread each,
+# so only half of the cores are used
+NUM_PROC = max(1, min(8, (os.cpu_count() or 1) // 2))
+
+def dumps_json(obj):
+    # orjson serializes several times faster than json when the speedups extra is installed
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def normalize_dataset_info(dataset_info):
+    # Hub datasets are described by a (path, name) tuple, name is None if the dataset has a single configuration
+    if isinstance(dataset_info, str):
+        return (dataset_info, None)
+    return dataset_info
+
 class BaseDataset:
     DATASET_NAME = None
     DATASET_INFO = None
+    # Datasets are small enough to be kept in memory, which avoids reading every row through the memory map
+    LOAD_KWARGS = {"keep_in_memory": True, "num_proc": NUM_PROC}
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "DATASET_INFO" in cls.__dict__:
+            cls.DATASET_INFO = normalize_dataset_info(cls.DATASET_INFO)
+
     def __init__(self, dataset_name=None, dataset_info=None):
         if dataset_name is not None:
             self.dataset_name = dataset_name
         else:
             self.dataset_name = self.DATASET_NAME
         if dataset_info is not None:
-            self.dataset_info = dataset_info
+            self.dataset_info = normalize_dataset_info(dataset_info)
         else:
             self.dataset_info = self.DATASET_INFO
 
-    def load_dataset(self, split=None):
-        if type(self.dataset_info) == tuple:
-            return datasets.load_dataset(self.dataset_info[0], self.dataset_info[1], split=split)
-        elif type(self.dataset_info) == str:
-            return datasets.load_dataset(self.dataset_info, split=split)
-        else:
+    def load_dataset(self, split=None, **kwargs):
+        if not isinstance(self.dataset_info, tuple):
             raise NotImplementedError
+        path, name = self.dataset_info
+        return datasets.load_dataset(path, name, split=split, **{**self.LOAD_KWARGS, **kwargs})
+
+    def load_iterable_dataset(self, split=None):
+        """
+        Loads the split as an IterableDataset. Hub datasets are streamed from the source, datasets with their own
+        loading logic are loaded first and then iterated over in shards
+        """
+        if type(self).load_dataset is BaseDataset.load_dataset:
+            path, name = self.dataset_info
+            return datasets.load_dataset(path, name, split=split, streaming=True)
+        dataset = self.load_dataset(split)
+        # A dataset can't be split into more shards than it has rows
+        return dataset.to_iterable_dataset(num_shards=max(1, min(NUM_PROC, len(dataset))))
 
     def preprocess_data(self, examples):
         return {"input_text": examples["text"], "label": examples["label"]}
 
+    def apply_preprocess(self, dataset, preprocess_function=None, **map_kwargs):
+        """
+        Applies preprocess_data to the dataset in batches, in parallel processes unless the dataset is streamed
+        Args:
+            dataset: Dataset to be preprocessed
+            preprocess_function: Function applied instead of preprocess_data, e.g. a module level wrapper of it
+            map_kwargs: Keyword arguments of Dataset.map overriding the defaults, e.g. remove_columns or fn_kwargs
+        """
+        map_kwargs = {"batched": True, "batch_size": 1000, "remove_columns": dataset.column_names, **map_kwargs}
+        if not isinstance(dataset, datasets.IterableDataset):
+            map_kwargs = {"num_proc": NUM_PROC, "load_from_cache_file": True, **map_kwargs}
+        return dataset.map(preprocess_function or self.preprocess_data, **map_kwargs)
+
     def postprocess_data(self, examples):
         return [ex.strip() if isinstance(ex, str) else ex for ex in examples]
 
     def deduplicate_data(self, dataset, input_column):
-        df = dataset.to_pandas()
-        df = df.drop_duplicates(subset=[input_column])
-        dedup_dataset = datasets.Dataset.from_pandas(df)
-        drop_columns = [col for col in dedup_dataset.column_names if col not in dataset.column_names]
-        dedup_dataset = dedup_dataset.map(remove_columns=drop_columns)
-        return dedup_dataset
+        # Keep the first occurrence of each value, index_in returns the index of the first match in the column
+        column = dataset.with_format("arrow")[input_column]
+        first_indices = pc.index_in(pc.unique(column), value_set=column)
+        return dataset.select(np.sort(first_indices.to_numpy()))
 
 
 class TRNewsDataset(BaseDataset):
     DATASET_NAME = "tr_news"
     DATASET_INFO = "batubayk/TR-News"
+    # News corpora are large, so they are kept memory mapped
+    LOAD_KWARGS = {"num_proc": NUM_PROC}
 
     def preprocess_data(self, examples):
         return {"input_text": examples["content"], "target_text": examples["abstract"]}
@@ -51,6 +106,7 @@ class TRNewsDataset(BaseDataset):
 class MLSumDataset(BaseDataset):
     DATASET_NAME = "mlsum"
     DATASET_INFO = ("mlsum", "tu")
+    LOAD_KWARGS = {"num_proc": NUM_PROC}
 
     def preprocess_data(self, examples):
         return {"input_text": examples["text"], "target_text": examples["summary"]}
@@ -58,6 +114,7 @@ class MLSumDataset(BaseDataset):
 class TRNewsTitleDataset(BaseDataset):
     DATASET_NAME = "tr_news"
     DATASET_INFO = "batubayk/TR-News"
+    LOAD_KWARGS = {"num_proc": NUM_PROC}
 
     def preprocess_data(self, examples):
         return {"input_text": examples["content"], "target_text": examples["title"]}
@@ -65,48 +122,51 @@ class TRNewsTitleDataset(BaseDataset):
 class MLSumTitleDataset(BaseDataset):
     DATASET_NAME = "mlsum"
     DATASET_INFO = ("mlsum", "tu")
+    LOAD_KWARGS = {"num_proc": NUM_PROC}
 
     def preprocess_data(self, examples):
         return {"input_text": examples["text"], "target_text": examples["title"]}
 
+@functools.lru_cache(maxsize=None)
+def load_combined_news(split, renamed_columns):
+    """
+    Loads and concatenates TR-News and MLSum. The result is memoized, so that the corpora are combined once per split
+    Args:
+        split: Split of the datasets to be loaded, all splits are loaded if None
+        renamed_columns: Pairs of MLSum column names and the TR-News column names they are renamed to
+    """
+    trnews = TRNewsDataset().load_dataset(split)
+    mlsum = MLSumDataset().load_dataset(split)
+    mlsum = mlsum.rename_columns(dict(renamed_columns))
+    if split is not None:
+        return datasets.concatenate_datasets([trnews, mlsum])
+    else:
+        return datasets.DatasetDict({key: datasets.concatenate_datasets([trnews[key], mlsum[key]]) for key in trnews.keys()})
+
+def stream_combined_news(split, renamed_columns):
+    """
+    Streams TR-News and MLSum, alternating between the two corpora until both are exhausted. Each example is seen once
+    Args:
+        split: Split of the datasets to be streamed
+        renamed_columns: Pairs of MLSum column names and the TR-News column names they are renamed to
+    """
+    trnews = TRNewsDataset().load_iterable_dataset(split)
+    mlsum = MLSumDataset().load_iterable_dataset(split).rename_columns(dict(renamed_columns))
+    return datasets.interleave_datasets([trnews, mlsum], stopping_strategy="all_exhausted_without_replacement")
+
 class CombinedNewsDataset(TRNewsDataset):
     DATASET_NAME = "combined_news"
     DATASET_INFO = ["tr_news", "mlsum"]
+    RENAMED_COLUMNS = (("text", "content"), ("summary", "abstract"))
 
     def load_dataset(self, split=None):
-        trnews = TRNewsDataset().load_dataset(split)
-        mlsum = MLSumDataset().load_dataset(split)
-        mlsum = mlsum.rename_column("text", "content")
-        mlsum = mlsum.rename_column("summary", "abstract")
-        if split is not None:
-            return datasets.concatenate_datasets([trnews, mlsum])
-        else:
-            combined_data = {}
-            for key in trnews.keys():
-                combined_data[key] = datasets.concatenate_datasets([trnews[key], mlsum[key]])
-            # Returns DatasetDict object which is compatible with other datasets but takes a lot of time
-            # return datasets.Dataset.from_dict(combined_data)
-            # Returns a dictionary of DatasetDicts which is not compatible with other datasets but is faster
-            return combined_data
-
-class CombinedNewsTitleDataset(TRNewsDataset):
-    DATASET_NAME = "combined_news"
-    DATASET_INFO = ["tr_news", "mlsum"]
+        return load_combined_news(split, self.RENAMED_COLUMNS)
 
-    def load_dataset(self, split=None):
-        trnews = TRNewsDataset().load_dataset(split)
-        mlsum = MLSumDataset().load_dataset(split)
-        mlsum = mlsum.rename_column("text", "content")
-        if split is not None:
-            return datasets.concatenate_datasets([trnews, mlsum])
-        else:
-            combined_data = {}
-            for key in trnews.keys():
-                combined_data[key] = datasets.concatenate_datasets([trnews[key], mlsum[key]])
-            # Returns DatasetDict object which is compatible with other datasets but takes a lot of time
-            # return datasets.Dataset.from_dict(combined_data)
-            # Returns a dictionary of DatasetDicts which is not compatible with other datasets but is faster
-            return combined_data
+    def load_iterable_dataset(self, split=None):
+        return stream_combined_news(split, self.RENAMED_COLUMNS)
+
+class CombinedNewsTitleDataset(CombinedNewsDataset):
+    RENAMED_COLUMNS = (("text", "content"),)
 
 class OpenSubtitlesDataset(BaseDataset):
     DATASET_NAME = "opensubtitles"
@@ -130,21 +190,79 @@ class TEDDataset(BaseDataset):
         return {"input_text": examples["src"], "target_text": examples["tgt"]}
 
 class LocalDataset(BaseDataset):
+    # Records the raw files that the converted files of a dataset were built from
+    CACHE_META_FILE = ".cache_meta.json"
 
     def __init__(self, dataset_loc):
         super().__init__()
         self.dataset_loc = dataset_loc
 
     def load_dataset(self, split=None, **kwargs):
+        kwargs = {**self.LOAD_KWARGS, **kwargs}
         return datasets.load_dataset(self.dataset_loc, data_files=self.dataset_info, split=split, **kwargs)
 
+    def files_fingerprint(self, files):
+        """
+        Returns the sizes and modification times of the files that exist
+        Args:
+            files: Paths of the files, e.g. the raw files the dataset is converted from
+        """
+        fingerprint = {}
+        for file in files:
+            if file.exists():
+                stat = file.stat()
+                fingerprint[file.name] = [stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+
+    def cache_meta(self, fingerprint):
+        # Converted files are recorded as well, so that deleted or modified ones are converted again
+        converted_files = [Path(self.dataset_loc) / filename for filename in self.dataset_info.values()]
+        return {"raw_files": fingerprint, "converted_files": self.files_fingerprint(converted_files)}
+
+    def is_converted(self, fingerprint):
+        """
+        Checks whether the converted files exist unchanged and were built from raw files with the given fingerprint
+        """
+        try:
+            with open(Path(self.dataset_loc) / self.CACHE_META_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f) == self.cache_meta(fingerprint)
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def save_cache_meta(self, fingerprint):
+        """
+        Records the fingerprints of the raw and converted files after all converted files are written. The record is
+        skipped if it can't be written, e.g. in a read-only directory, and the files are converted again next time
+        """
+        try:
+            with open(Path(self.dataset_loc) / self.CACHE_META_FILE, 'w', encoding='utf-8') as f:
+                json.dump(self.cache_meta(fingerprint), f)
+        except OSError as e:
+            print(f"Could not save the conversion cache record: {e}")
+
+    def convert_raw_files(self, convert_fn, split_args):
+        """
+        Converts the raw files of the splits, in parallel processes if there are several. The splits are written to
+        separate files, so they are independent of each other
+        Args:
+            convert_fn: Module level function converting a single split, called with an element of split_args
+            split_args: Arguments of convert_fn for each split to be converted
+        """
+        num_workers = min(NUM_PROC, len(split_args))
+        if num_workers > 1:
+            with multiprocessing.Pool(num_workers) as pool:
+                pool.map(convert_fn, split_args)
+        else:
+            for args in split_args:
+                convert_fn(args)
+
 
 class STSb_TRDataset(LocalDataset):
     DATASET_NAME = "stsb_tr"
     DATASET_INFO = {'train': 'stsb_tr_train.tsv', 'test': 'stsb_tr_test.tsv', 'validation': 'stsb_tr_dev.tsv'}
 
     def preprocess_data(self, examples, skip_output_processing=False):
-        input = [f"ilk cümle: {examples['sentence1'][i]} ikinci cümle: {examples['sentence2'][i]}" for i in range(len(examples["sentence1"]))]
+        input = [f"ilk cümle: {sentence1} ikinci cümle: {sentence2}" for sentence1, sentence2 in zip(examples['sentence1'], examples['sentence2'])]
         # If used with the classification mode, skip the output processing
         if skip_output_processing:
             return {"input_text": input, "label": examples["score"]}
@@ -184,7 +302,14 @@ class NLI_TRDataset(BaseDataset):
             dataset = super().load_dataset(split="validation_mismatched")
         else:
             dataset = super().load_dataset(split)
-        return dataset.filter(lambda example: example["label"] != -1)
+        if isinstance(dataset, datasets.DatasetDict):
+            return datasets.DatasetDict({key: self.drop_unlabeled(split_dataset) for key, split_dataset in dataset.items()})
+        return self.drop_unlabeled(dataset)
+
+    def drop_unlabeled(self, dataset):
+        # Drop the examples without a gold label, the mask is computed on the Arrow column instead of row by row
+        labels = dataset.with_format("arrow")["label"]
+        return dataset.select(pc.indices_nonzero(pc.not_equal(labels, -1)).cast("int64").to_numpy())
 
     def preprocess_data(self, examples, skip_output_processing=False):
 
@@ -201,6 +326,32 @@ class NLI_TRDataset(BaseDataset):
 class QADataset(BaseDataset):
     DATASET_NAME = "qa"
 
+    def _extract_qa_examples(self, examples):
+        """
+        Abstract method implemented by each QA dataset, both preprocessing tasks are built from its output
+        Args:
+            examples: Batch of examples of the dataset
+        Returns:
+            Parallel lists of question answering input prefixes, questions and answers. Prefixes are None if the questions
+            of the dataset have no context
+        """
+        raise NotImplementedError
+
+    def preprocess_question_answering(self, examples):
+        input_prefixes, questions, answers = self._extract_qa_examples(examples)
+        if input_prefixes is not None:
+            questions = [input_prefix + question for input_prefix, question in zip(input_prefixes, questions)]
+        return {"input_text": questions, "target_text": answers}
+
+    def preprocess_question_generation(self, examples):
+        _, questions, answers = self._extract_qa_examples(examples)
+        return {"input_text": answers, "target_text": questions}
+
+    def preprocess_data(self, examples, question_generation=False):
+        if question_generation:
+            return self.preprocess_question_generation(examples)
+        return self.preprocess_question_answering(examples)
+
     def postprocess_data(self, examples):
         return [ex.strip() for ex in examples]
 
@@ -215,22 +366,22 @@ class ExamsDataset(QADataset):
         else:
             return super().load_dataset(split)
 
-    def preprocess_data(self, examples):
-        input_texts, target_texts = [], []
+    def _extract_qa_examples(self, examples):
+        questions, answers = [], []
         for question, answer_key in zip(examples["question"], examples["answerKey"]):
             question_str = question["stem"]
             choices = question["choices"]
             if answer_key not in choices['label']:
-                input_texts.append(question_str)
-                target_texts.append('')
+                questions.append(question_str)
+                answers.append('')
                 continue
             answer_order = choices['label'].index(answer_key)
             answer = choices['text'][answer_order]
             if not answer:
                 continue
-            input_texts.append(question_str)
-            target_texts.append(answer)
-        return {"input_text": input_texts, 'target_text': target_texts}
+            questions.append(question_str)
+            answers.append(answer)
+        return None, questions, answers
 
 class TQUADDataset(LocalDataset, QADataset):
     DATASET_NAME = "tquad"
@@ -239,44 +390,42 @@ class TQUADDataset(LocalDataset, QADataset):
     def load_dataset(self, split=None):
         return super().load_dataset(split, field='data')
 
-    def preprocess_data(self, examples):
-        input_texts, target_texts = [], []
+    def _extract_qa_examples(self, examples):
+        input_prefixes, questions, answers = [], [], []
         for paragraphs in examples['paragraphs']:
             for paragraph in paragraphs:
-                qas = paragraph['qas']
-                context = paragraph['context'].strip()
-                for qa in qas:
-                    question = qa['question'].strip()
-                    answers = qa['answers']
-                    answer = answers[0]['text'].strip()
-                    input_text = f"Bağlam: {context} | Soru: {question}"
-                    target_text = answer
-                    input_texts.append(input_text)
-                    target_texts.append(target_text)
-        return {"input_text": input_texts, "target_text": target_texts}
+                # The context part of the input is built once and shared by all questions of the paragraph
+                input_prefix = 'Bağlam: ' + paragraph['context'].strip() + ' | Soru: '
+                for qa in paragraph['qas']:
+                    input_prefixes.append(input_prefix)
+                    questions.append(qa['question'].strip())
+                    answers.append(qa['answers'][0]['text'].strip())
+        return input_prefixes, questions, answers
 
 class MKQADataset(QADataset):
     DATASET_NAME = "mkqa"
     DATASET_INFO = "mkqa"
+    # Only the Turkish queries and answers are used, the rest of the columns are dropped right after loading
+    COLUMNS = ["queries", "answers"]
 
     def load_dataset(self, split='train'):
-        return datasets.load_dataset('mkqa', split='train')
+        # MKQA only has a train split, the evaluation splits are sampled from it
+        return super().load_dataset(split='train').select_columns(self.COLUMNS)
 
-    def preprocess_data(self, examples):
-        input_texts, target_texts = [], []
-        for queries, answers in zip(examples['queries'], examples['answers']):
-            query = queries['tr']
-            answer = answers['tr'][0]['text']
-            if not answer:
-                input_texts.append(query)
-                target_texts.append('')
-                continue
-            input_texts.append(query)
-            target_texts.append(answer)
-        return {"input_text": input_texts, "target_text": target_texts}
+    def load_iterable_dataset(self, split='train'):
+        path, name = self.dataset_info
+        return datasets.load_dataset(path, name, split='train', streaming=True).select_columns(self.COLUMNS)
+
+    def _extract_qa_examples(self, examples):
+        questions = [queries['tr'] for queries in examples['queries']]
+        # Unanswerable queries have no answer text
+        answers = [answers['tr'][0]['text'] or '' for answers in examples['answers']]
+        return None, questions, answers
 
 class NERDataset(BaseDataset):
     NER_label_translation_d = {"Kişi": "PER", "Yer": "LOC", "Kuruluş": "ORG"}
+    # Names of the entity types in the target texts
+    TAG_TYPE_NAMES = {"PER": "Kişi", "LOC": "Yer", "ORG": "Kuruluş", "PERSON": "Kişi", "LOCATION": "Yer", "ORGANIZATION": "Kuruluş"}
     NER_label_int_dict = {"PER": 1, "LOC": 3, "ORG": 5}
     BIO_mapping = {
         "O": 0,
@@ -336,6 +485,10 @@ class NERDataset(BaseDataset):
             example = example.strip()
             input_tokens = input_t.split(' ')
             label_l = ['O' for _ in range(len(input_tokens))]
+            # Entities are matched to the first occurrence of their tokens
+            token_to_idx = {}
+            for i, token in enumerate(input_tokens):
+                token_to_idx.setdefault(token, i)
             if example == 'Bulunamadı.':
                 labels.append(label_l)
             else:
@@ -347,6 +500,7 @@ class NERDataset(BaseDataset):
                     tag_type = el_split[0].strip()
                     if tag_type not in NERDataset.NER_label_translation_d:
                         continue
+                    tag = NERDataset.NER_label_translation_d[tag_type]
                     if ', ' not in el_split[1]:
                         el_l = [el_split[1]]
                     else:
@@ -355,17 +509,14 @@ class NERDataset(BaseDataset):
                         if el.strip() == '':
                             continue
                         el_split = el.split(' ')
-                        if el_split[0] not in input_tokens or el_split[-1] not in input_tokens:
+                        if el_split[0] not in token_to_idx or el_split[-1] not in token_to_idx:
                             continue
-                        if len(el_split) == 1:
-                            start = input_tokens.index(el_split[0])
-                            label_l[start] = 'B-' + NERDataset.NER_label_translation_d[tag_type]
-                        else:
-                            start = input_tokens.index(el_split[0])
-                            label_l[start] = 'B-' + NERDataset.NER_label_translation_d[tag_type]
-                            end = input_tokens.index(el_split[-1])
+                        start = token_to_idx[el_split[0]]
+                        label_l[start] = 'B-' + tag
+                        if len(el_split) > 1:
+                            end = token_to_idx[el_split[-1]]
                             for i in range(start+1, end+1):
-                                label_l[i] = 'I-' + NERDataset.NER_label_translation_d[tag_type]
+                                label_l[i] = 'I-' + tag
                 labels.append(label_l)
         return labels
 
@@ -378,6 +529,8 @@ class NERDataset(BaseDataset):
 class WikiANNDataset(NERDataset):
     DATASET_NAME = "wikiann"
     DATASET_INFO = ("wikiann", "tr")
+    # Spans are prefixed with their entity type, e.g. 'PER: Mustafa Kemal'
+    SPAN_TYPE_NAMES = {tag: NERDataset.TAG_TYPE_NAMES[tag] for tag in ("PER", "LOC", "ORG")}
 
     def preprocess_data(self, examples, skip_output_processing=False, tokenizer=None):
         if skip_output_processing:
@@ -388,36 +541,47 @@ class WikiANNDataset(NERDataset):
             tag_type = ''
             tag_dict = {}
             for span in spans:
-                span = span.replace('PER: ', 'Kişi: ').replace('LOC: ', 'Yer: ').replace('ORG: ', 'Kuruluş: ')
-                if span.startswith('Kişi: '):
-                    tag_type = 'PERSON'
-                elif span.startswith('Yer: '):
-                    tag_type = 'LOCATION'
-                elif span.startswith('Kuruluş: '):
-                    tag_type = 'ORGANIZATION'
-                if tag_type not in tag_dict:
-                    tag_dict[tag_type] = []
-                tag_dict[tag_type].append(span.replace('Kişi: ', '').replace('Yer: ', '').replace('Kuruluş: ', ''))
-            for tag_type in tag_dict.keys():
-                new_l = []
-                for el in tag_dict[tag_type]:
-                    if el not in new_l:
-                        new_l.append(el)
-                tag_dict[tag_type] = new_l
-            input_text = ' '.join(tokens)
-            target_l = []
-            target_text = ''
-            for tag_type in tag_dict.keys():
-                target_l.append(f'{tag_type}: {", ".join(tag_dict[tag_type])}')
-            target_text = ' | '.join(target_l)
-            target_text = target_text.replace('PERSON: ', 'Kişi: ').replace('LOCATION: ', 'Yer: ').replace('ORGANIZATION: ', 'Kuruluş: ').strip()
-            input_text = input_text.strip()
+                span_type, _, entity = span.partition(': ')
+                if span_type in self.SPAN_TYPE_NAMES:
+                    tag_type = self.SPAN_TYPE_NAMES[span_type]
+                    span = entity
+                tag_dict.setdefault(tag_type, []).append(span)
+            input_text = ' '.join(tokens).strip()
+            # Remove duplicate entities while keeping their order
+            target_text = ' | '.join(f'{tag_type}: {", ".join(dict.fromkeys(entities))}' for tag_type, entities in tag_dict.items()).strip()
             if not target_text:
                 target_text = 'Bulunamadı.'
             input_texts.append(input_text)
             target_texts.append(target_text)
         return {'input_text': input_texts, 'target_text': target_texts}
 
+def convert_milliyet_split(data_file):
+    """
+    Converts the raw Milliyet NER file of a split, one "token tag" pair per line, to a JSON lines file
+    Args:
+        data_file: Path of the converted file, the raw file has the same name with the .txt suffix
+    """
+    with open(data_file.with_suffix('.txt'), 'r', encoding='utf-8') as f:
+        content = f.read()
+    data = content.split('\n\n')
+    records = []
+    for example in data:
+        if example.strip() == '':
+            continue
+        lines = example.split('\n')
+        tokens = []
+        tags = []
+        for line in lines:
+            if line.strip() == '':
+                break
+            token, tag = line.split(' ')
+            tokens.append(token)
+            tags.append(tag)
+        el = {'tokens': tokens, 'ner_tags': tags}
+        records.append(dumps_json(el) + '\n')
+    with open(data_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(records))
+
 class MilliyetNERDataset(LocalDataset,NERDataset):
     DATASET_NAME = "milliyet_ner"
     DATASET_INFO = {'train': 'train.json', 'test': 'test.json', 'validation': 'dev.json'}
@@ -426,29 +590,15 @@ class MilliyetNERDataset(LocalDataset,NERDataset):
         super().__init__(dataset_loc)
 
     def load_dataset(self, split=None):
-        for _, filename in self.dataset_info.items():
-            data_file = Path(self.dataset_loc) / filename
-            if data_file.exists():
-                continue
-            else:
-                with open(data_file.with_suffix('.txt'), 'r', encoding='utf-8') as f:
-                    content = f.read()
-                data = content.split('\n\n')
-                for example in data:
-                    if example.strip() == '':
-                        continue
-                    lines = example.split('\n')
-                    tokens = []
-                    tags = []
-                    for line in lines:
-                        if line.strip() == '':
-                            break
-                        token, tag = line.split(' ')
-                        tokens.append(token)
-                        tags.append(tag)
-                    el = {'tokens': tokens, 'ner_tags': tags}
-                    with open(data_file, 'a', encoding='utf-8') as f:
-                        f.write(json.dumps(el) + '\n')
+        fingerprint = self.files_fingerprint([(Path(self.dataset_loc) / filename).with_suffix('.txt') for filename in self.dataset_info.values()])
+        converted = self.is_converted(fingerprint)
+        if not converted:
+            # Splits are converted again when their raw files change, splits provided without raw files are used as is
+            data_files = [Path(self.dataset_loc) / filename for filename in self.dataset_info.values()]
+            data_files = [data_file for data_file in data_files if data_file.with_suffix('.txt').exists()]
+            if data_files:
+                self.convert_raw_files(convert_milliyet_split, data_files)
+                self.save_cache_meta(fingerprint)
         return super().load_dataset(split)
 
     def preprocess_data(self, examples, skip_output_processing=False, tokenizer=None):
@@ -461,101 +611,104 @@ class MilliyetNERDataset(LocalDataset,NERDataset):
             for j, tag in enumerate(tags):
                 if tag == 'O':
                     if token_str:
-                        if tag_type not in tag_dict:
-                            tag_dict[tag_type] = []
-                        tag_dict[tag_type].append(token_str)
+                        tag_dict.setdefault(tag_type, []).append(token_str)
                     token_str, tag_type = '', ''
                 elif tag.startswith('B-'):
                     if token_str:
-                        if tag_type not in tag_dict:
-                            tag_dict[tag_type] = []
-                        tag_dict[tag_type].append(token_str)
+                        tag_dict.setdefault(tag_type, []).append(token_str)
                     tag_type = tag[2:]
                     token_str = tokens[j]
                 elif tag.startswith('I-'):
-                    token_str += ' ' + tokens[tags.index(tag)]
+                    token_str += ' ' + tokens[j]
             if token_str:
-                if tag_type not in tag_dict:
-                    tag_dict[tag_type] = []
-                tag_dict[tag_type].append(token_str)
-            for j, tag_type in enumerate(tag_dict):
-                new_l = []
-                for el in tag_dict[tag_type]:
-                    if el not in new_l:
-                        new_l.append(el)
-                tag_dict[tag_type] = new_l
+                tag_dict.setdefault(tag_type, []).append(token_str)
+            # Remove duplicate entities while keeping their order
+            for tag_type in tag_dict:
+                tag_dict[tag_type] = list(dict.fromkeys(tag_dict[tag_type]))
             input_text = ' '.join(tokens)
             target_l = []
             target_text = ''
             for j, tag_type in enumerate(tag_dict):
-                target_l.append(f'{tag_type}: {", ".join(tag_dict[tag_type])}')
+                target_l.append(f'{self.TAG_TYPE_NAMES.get(tag_type, tag_type)}: {", ".join(tag_dict[tag_type])}')
             target_text = ' | '.join(target_l)
             input_text = input_text.strip()
-            target_text = target_text.replace('PERSON: ', 'Kişi: ').replace('LOCATION: ', 'Yer: ').replace('ORGANIZATION: ', 'Kuruluş: ').strip()
+            target_text = target_text.strip()
             if not target_text:
                 target_text = 'Bulunamadı.'
             input_texts.append(input_text)
             target_texts.append(target_text)
         return {'input_text': input_texts, 'target_text': target_texts}
 
+def convert_conllu_split(args):
+    """
+    Converts the CoNLL-U file of a split to a JSON lines file
+    Args:
+        args: Tuple of the path of the CoNLL-U file, the path of the converted file and the name of the split
+    """
+    data_file, output_file, split_t = args
+    with open(data_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    sents = content.split('\n\n')
+    records = []
+    for sent in sents:
+        lines = sent.split('\n')
+        sent_id = ''
+        d_t = {}
+        id_l, token_l, tag_l = [], [], []
+        for i, line in enumerate(lines):
+            # Metadata lines are of the form "# field = value"
+            field, _, value = line[2:].partition(' = ') if line.startswith('# ') else ('', '', '')
+            if field and value:
+                field = field.strip()
+                value = value.strip()
+                if field == 'sent_id':
+                    sent_id = value
+                else:
+                    d_t[field] = value
+            if line.count('\t') >= POSDataset.NUM_ANNOTATION_TABS:
+                for row in lines[i:]:
+                    if row.strip() == '':
+                        break
+                    fields = row.split('\t')
+                    id_t, token, tag = fields[0], fields[1], fields[3]
+                    if '-' in id_t:
+                        continue
+                    id_l.append(id_t)
+                    token_l.append(token)
+                    tag_l.append(tag)
+                d_t['split'] = split_t
+                d_t['tokens'] = token_l
+                d_t['tags'] = tag_l
+                d_t['sent_id'] = sent_id
+                d_t['ids'] = id_l
+                records.append(dumps_json(d_t) + '\n')
+                break
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(records))
+
 class POSDataset(LocalDataset):
     DATASET_NAME = "pos"
     DATASET_INFO = {'train': 'train.json', 'test': 'test.json', 'validation': 'dev.json'}
     POS_TR_DICT = { "ADP": "edat", "AUX": "yardımcı", "PRON": "zamir", "NOUN": "isim", "PROPN": "özel", "INTJ": "ünlem", "PART": "tanımcık", "CCONJ": "eşgüdümlü", "VERB": "fiil", "SYM": "sembol", "DET": "belirteç", "ADV": "zarf", "ADJ": "sıfat", "X": "diğer", "SCONJ": "yantümce", "NUM": "sayı", "PUNCT": "noktalama" }
     POS_INT_DICT = {"edat": 0, "yardımcı": 1, "zamir": 2, "isim": 3, "özel": 4, "ünlem": 5, "tanımcık": 6, "eşgüdümlü": 7, "fiil": 8, "sembol": 9, "belirteç": 10, "zarf": 11, "sıfat": 12, "diğer": 13, "yantümce": 14, "sayı": 15, "noktalama": 16}
     label_mapping = {v: k for k, v in POS_INT_DICT.items()}
+    # Annotation lines of CoNLL-U files have ten tab separated fields
+    NUM_ANNOTATION_TABS = 9
 
     def __init__(self, dataset_loc=None, dataset_raw_info=None):
         super().__init__(dataset_loc)
         self.DATASET_RAW_INFO = dataset_raw_info
 
     def load_dataset(self, split=None):
-        md_pattern = re.compile('^# (.+?) = (.+?)$')
-        annotation_pattern = re.compile('(.+\t){9}.+')
-        for split_t, filename in self.DATASET_RAW_INFO.items():
-            data_file = Path(self.dataset_loc) / filename
-            output_file = Path(self.dataset_loc) / self.DATASET_INFO[split_t]
-            if output_file.exists():
-                continue
-            else:
-                with open(data_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                sents = content.split('\n\n')
-                for sent in sents:
-                    lines = sent.split('\n')
-                    sent_id = ''
-                    d_t = {}
-                    id_l, token_l, tag_l = [], [], []
-                    for i, line in enumerate(lines):
-                        md_match = md_pattern.match(line)
-                        if md_match:
-                            field = md_match.group(1).strip()
-                            value = md_match.group(2).strip()
-                            if field == 'sent_id':
-                                sent_id = value
-                            else:
-                                d_t[field] = value
-                        annotation_match = annotation_pattern.match(line)
-                        if annotation_match:
-                            annotation = '\n'.join(lines[i:])
-                            for row in annotation.split('\n'):
-                                if row.strip() == '':
-                                    break
-                                fields = row.split('\t')
-                                id_t, token, tag = fields[0], fields[1], fields[3]
-                                if '-' in id_t:
-                                    continue
-                                id_l.append(id_t)
-                                token_l.append(token)
-                                tag_l.append(tag)
-                            d_t['split'] = split_t
-                            d_t['tokens'] = token_l
-                            d_t['tags'] = tag_l
-                            d_t['sent_id'] = sent_id
-                            d_t['ids'] = id_l
-                            with open(output_file, 'a', encoding='utf-8') as f:
-                                f.write(json.dumps(d_t) + '\n')
-                            break
+        fingerprint = self.files_fingerprint([Path(self.dataset_loc) / filename for filename in self.DATASET_RAW_INFO.values()])
+        converted = self.is_converted(fingerprint)
+        if not converted:
+            # Splits are converted again when their raw files change, splits provided without raw files are used as is
+            split_args = [(Path(self.dataset_loc) / filename, Path(self.dataset_loc) / self.DATASET_INFO[split_t], split_t) for split_t, filename in self.DATASET_RAW_INFO.items()]
+            split_args = [args for args in split_args if args[0].exists()]
+            if split_args:
+                self.convert_raw_files(convert_conllu_split, split_args)
+                self.save_cache_meta(fingerprint)
         return super().load_dataset(split)
 
     def preprocess_labels(self, examples, tokenizer):
@@ -655,9 +808,11 @@ class ClassificationDataset(BaseDataset):
     IN_LABEL_DICT = None
     OUT_LABEL_DICT = None
 
-    def __init__(self, dataset_name=None):
-        super().__init__(dataset_name)
-        self.OUT_LABEL_DICT = {v: k for k, v in self.IN_LABEL_DICT.items()}
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The label names are parsed back to the labels with the inverted dict, which is shared by all instances
+        if "IN_LABEL_DICT" in cls.__dict__:
+            cls.OUT_LABEL_DICT = {v: k for k, v in cls.IN_LABEL_DICT.items()}
 
     def postprocess_data(self, examples):
         return [self.OUT_LABEL_DICT.get(ex.strip(), -1) for ex in examples]
@@ -755,17 +910,17 @@ DATASET_MAPPING_NAMES = [
         ("tr_product_reviews", "ProductDataset"),
         ("17bintweet_sentiment", "SentimentTweetDataset"),
     ]
+DATASET_MAPPING = dict(DATASET_MAPPING_NAMES)
 
+@functools.lru_cache(maxsize=None)
 def str_to_class(classname):
     return getattr(sys.modules[__name__], classname)
 
 def initialize_dataset(dataset_name, dataset_loc=None):
-    for dataset_mapping_name in DATASET_MAPPING_NAMES:
-        if dataset_name == dataset_mapping_name[0]:
-            dataset_class = str_to_class(dataset_mapping_name[1])
-            if dataset_loc != "" and dataset_loc is not None:
-                dataset = dataset_class(dataset_loc)
-            else:
-                dataset = dataset_class(dataset_name)
-            return dataset
-    raise NotImplementedError
+    class_name = DATASET_MAPPING.get(dataset_name)
+    if class_name is None:
+        raise NotImplementedError
+    dataset_class = str_to_class(class_name)
+    if dataset_loc != "" and dataset_loc is not None:
+        return dataset_class(dataset_loc)
+    return dataset_class(dataset_name)
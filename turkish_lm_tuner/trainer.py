@@ -9,10 +9,11 @@ from transformers import (
     AutoConfig
 )
 from transformers.optimization import Adafactor, AdafactorSchedule
-from transformers import DataCollatorForTokenClassification
+from transformers import DataCollatorForTokenClassification, DataCollatorForSeq2Seq, DataCollatorWithPadding
 from .evaluator import (
     EvaluatorForClassification,
-    EvaluatorForConditionalGeneration
+    EvaluatorForConditionalGeneration,
+    DataCollatorWithoutColumns
 )
 from .t5_classifier import T5ForClassification
 import json 
@@ -123,6 +124,7 @@ class TrainerForConditionalGeneration(BaseModelTrainer):
             eval_dataset=eval_dataset,
             compute_metrics=self.evaluator.compute_metrics,
             optimizers=(optimizer, lr_scheduler),
+            data_collator=DataCollatorWithoutColumns(DataCollatorForSeq2Seq(self.tokenizer, model=model, padding='longest')),
             callbacks = [EarlyStoppingCallback(early_stopping_patience=3)]
         )
 
@@ -161,10 +163,11 @@ class TrainerForClassification(BaseModelTrainer):
         logger.info("Training in classification mode")
 
         if self.task in ['ner', 'pos_tagging']:
-            data_collator = DataCollatorForTokenClassification(tokenizer=self.tokenizer)
+            data_collator = DataCollatorWithoutColumns(DataCollatorForTokenClassification(tokenizer=self.tokenizer))
             tokenizer = self.tokenizer
         else:
-            data_collator, tokenizer = None, None
+            data_collator = DataCollatorWithoutColumns(DataCollatorWithPadding(tokenizer=self.tokenizer))
+            tokenizer = None
         training_args = TrainingArguments(
             metric_for_best_model='eval_loss',
             load_best_model_at_end=True,